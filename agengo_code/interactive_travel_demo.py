@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
+import asyncio
+import logging
 import sys
 import os
+import uuid
 from typing import Callable, Any
+from dotenv import load_dotenv
 from langchain_core.runnables import RunnableConfig
 
 # Add current directory to Python path for local imports
@@ -63,10 +67,10 @@ def get_user_input_with_default(
         print(f"Invalid input, using default value {default}")
         return default
 
-def run_interactive_demo():
+async def run_interactive_demo():
     """Main function to run the interactive travel assistant demo."""
     try:
-        from travel_assistant import graph  # Import the travel assistant graph
+        from travel_assistant import open_graph  # Import the travel assistant graph
 
         # Get user input for city, days, and number of travelers
         city = get_user_input_with_default(
@@ -99,45 +103,57 @@ def run_interactive_demo():
         print(f"👤 Max Travelers: {max_travelers}")
         print("=" * 50)
 
-        current_state = initial_state.copy()
-        thread = {"configurable": {"thread_id": "1"}}  # Thread context for the assistant
+        async with open_graph() as graph:
+            current_state = initial_state.copy()
+            # Checkpoints persist across runs, so every demo run gets its own thread
+            thread = {"configurable": {"thread_id": str(uuid.uuid4())}}
 
-        # Stream traveler generation events and display them
-        for event in graph.stream(current_state, thread, stream_mode="values"):
-            travelers = event.get('travelers', '')
-            if travelers:
-                for traveler in travelers:
-                    print("👤" * 50)
-                    print(f"Name: {traveler.name}")
-                    print(f"Description: {traveler.description}")
+            # Stream traveler generation events and display them
+            async for event in graph.astream(current_state, thread, stream_mode="values"):
+                travelers = event.get('travelers', '')
+                if travelers:
+                    for traveler in travelers:
+                        print("👤" * 50)
+                        print(f"Name: {traveler.name}")
+                        print(f"Description: {traveler.description}")
 
-        # Get user feedback for travelers and update the state
-        feedback_t = get_user_feedback(
-            "Please review the generated travelers above and provide feedback to regenerate:"
-        )
-        graph.update_state(
-            thread, {"human_feedback_traveler": feedback_t}, as_node="human_feedback_traveler_node"
-        )
-        # Stream updated travelers after feedback
-        for event in graph.stream(None, thread, stream_mode="values"):
-            travelers = event.get('travelers', '')
-            if travelers:
-                for traveler in travelers:
-                    print("👤" * 50)
-                    print(f"Name: {traveler.name}")
-                    print(f"Description: {traveler.description}")
+            # Get user feedback for travelers and update the state
+            feedback_t = get_user_feedback(
+                "Please review the generated travelers above and provide feedback to regenerate:"
+            )
+            await graph.aupdate_state(
+                thread, {"human_feedback_traveler": feedback_t}, as_node="human_feedback_traveler_node"
+            )
+            # Stream updated travelers after feedback
+            async for event in graph.astream(None, thread, stream_mode="values"):
+                travelers = event.get('travelers', '')
+                if travelers:
+                    for traveler in travelers:
+                        print("👤" * 50)
+                        print(f"Name: {traveler.name}")
+                        print(f"Description: {traveler.description}")
 
-        # Reset feedback and stream the final plan
-        graph.update_state(
-            thread, {"human_feedback_traveler": None}, as_node="human_feedback_traveler_node"
-        )
-        for event in graph.stream(None, thread, stream_mode="values"):
-            final_plan = event.get('final_plan', '')
-            if final_plan:
-                print("final_plan")
-                print("📅" * 50)
-                print(final_plan)
-                print("📅" * 50)
+            # Reset feedback and stream the final plan
+            await graph.aupdate_state(
+                thread, {"human_feedback_traveler": None}, as_node="human_feedback_traveler_node"
+            )
+            print("final_plan")
+            print("📅" * 50)
+            streamed = False
+            async for event in graph.astream_events(None, thread, version="v2"):
+                # Print plan tokens as soon as write_plan generates them
+                if (
+                    event["event"] == "on_chat_model_stream"
+                    and event["metadata"].get("langgraph_node") == "write_plan"
+                ):
+                    streamed = True
+                    print(event["data"]["chunk"].content, end="", flush=True)
+            if not streamed:
+                # A cached plan arrives without token events, so read it from the checkpoint
+                snapshot = await graph.aget_state(thread)
+                print(snapshot.values.get("final_plan", ""), end="")
+            print()
+            print("📅" * 50)
         print("✅ Demo complete!")
         print("=" * 50)
     except Exception as e:
@@ -146,4 +162,13 @@ def run_interactive_demo():
 
 # Entry point for the script
 if __name__ == "__main__":
-    run_interactive_demo()
\ No newline at end of file
+    # Configure logging here rather than in travel_assistant so importing it leaves the root logger alone
+    load_dotenv()
+    log_level = os.environ.get("LOG_LEVEL", "WARNING").upper()
+    if not isinstance(logging.getLevelName(log_level), int):
+        print(f"Unknown LOG_LEVEL {log_level!r}, using WARNING")
+        log_level = "WARNING"
+    # LOG_LEVEL only applies to travel_assistant; third-party libraries stay at WARNING
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("travel_assistant").setLevel(log_level)
+    asyncio.run(run_interactive_demo())
\ No newline at end of file
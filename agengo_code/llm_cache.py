@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+class LLMCache(BaseCache):
+    """SHA-256 keyed LLM response cache with an in-memory LRU and optional Redis backend.
+
+    LangChain passes the serialized messages as `prompt` and the model name, parameters,
+    bound tools and response schema as `llm_string`, so a hit requires an exact match on
+    all of them. Only attach this to deterministic (temperature=0) models.
+    """
+
+    def __init__(self, maxsize: int = 1024, redis_url: Optional[str] = None, ttl: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, RETURN_VAL_TYPE]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            import redis  # Only needed when a shared cache is configured
+
+            self._redis = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        payload = json.dumps({"prompt": prompt, "llm": llm_string}, sort_keys=True)
+        return "llm_cache:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, return_val: RETURN_VAL_TYPE) -> None:
+        with self._lock:
+            self._entries[key] = return_val
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Return cached generations for this prompt and model, if any."""
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self._redis is None:
+            return None
+        raw = self._redis.get(key)
+        if raw is None:
+            return None
+        return_val = [loads(generation) for generation in json.loads(raw)]
+        self._remember(key, return_val)
+        return return_val
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Store generations for this prompt and model."""
+        key = self._key(prompt, llm_string)
+        self._remember(key, return_val)
+        if self._redis is not None:
+            # Dump each generation on its own so langchain converts structured-output models
+            # in additional_kwargs["parsed"] into plain dicts instead of not_implemented stubs
+            self._redis.set(key, json.dumps([dumps(generation) for generation in return_val]), ex=self.ttl)
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        # The in-memory path never blocks, so skip the executor hop
+        if self._redis is None:
+            return self.lookup(prompt, llm_string)
+        return await super().alookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self._redis is None:
+            return self.update(prompt, llm_string, return_val)
+        return await super().aupdate(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        """Drop all cached responses."""
+        with self._lock:
+            self._entries.clear()
+        if self._redis is not None:
+            for key in self._redis.scan_iter("llm_cache:*"):
+                self._redis.delete(key)
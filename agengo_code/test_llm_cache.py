@@ -0,0 +1,75 @@
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from pydantic import BaseModel
+
+from llm_cache import LLMCache
+
+class FakeRedis:
+    """Minimal stand-in for the redis client calls LLMCache makes."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value.encode("utf-8")
+
+    def scan_iter(self, pattern):
+        return list(self.store)
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+class SearchQuery(BaseModel):
+    search_query: str
+
+def _generation(text: str) -> ChatGeneration:
+    return ChatGeneration(message=AIMessage(content=text))
+
+def test_lookup_returns_updated_generations():
+    cache = LLMCache()
+    generations = [_generation("hello")]
+    cache.update("prompt", "gpt-4o", generations)
+    assert cache.lookup("prompt", "gpt-4o") == generations
+    assert cache.lookup("prompt", "gpt-4o-mini") is None
+    assert cache.lookup("other prompt", "gpt-4o") is None
+
+def test_lru_evicts_least_recently_used():
+    cache = LLMCache(maxsize=2)
+    cache.update("a", "llm", [_generation("a")])
+    cache.update("b", "llm", [_generation("b")])
+    # Touch "a" so "b" becomes the least recently used entry
+    assert cache.lookup("a", "llm") is not None
+    cache.update("c", "llm", [_generation("c")])
+    assert cache.lookup("b", "llm") is None
+    assert cache.lookup("a", "llm") is not None
+    assert cache.lookup("c", "llm") is not None
+
+def test_redis_round_trip_keeps_structured_output():
+    redis = FakeRedis()
+    writer = LLMCache()
+    writer._redis = redis
+    message = AIMessage(
+        content='{"search_query": "tokyo ramen"}',
+        additional_kwargs={"parsed": SearchQuery(search_query="tokyo ramen")},
+    )
+    writer.update("prompt", "gpt-4o", [ChatGeneration(message=message)])
+
+    # A fresh instance has an empty LRU, so the hit must come from Redis
+    reader = LLMCache()
+    reader._redis = redis
+    cached = reader.lookup("prompt", "gpt-4o")
+    assert cached is not None
+    assert cached[0].message.content == message.content
+    assert cached[0].message.additional_kwargs["parsed"] == {"search_query": "tokyo ramen"}
+
+def test_clear_drops_memory_and_redis_entries():
+    redis = FakeRedis()
+    cache = LLMCache()
+    cache._redis = redis
+    cache.update("prompt", "gpt-4o", [_generation("hello")])
+    cache.clear()
+    assert redis.store == {}
+    assert cache.lookup("prompt", "gpt-4o") is None
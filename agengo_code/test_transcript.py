@@ -0,0 +1,30 @@
+import pytest
+
+from transcript import strip_source_list
+
+BODY = "Head to Tsukiji early [D1].\n[D2] reports that the market opens at 5am."
+
+@pytest.mark.parametrize(
+    "sources",
+    [
+        "Sources:\n- [D1] https://a.example\n- [D2] https://b.example",
+        "### Sources\n1. [D1] https://a.example\n2. [D2] https://b.example",
+        "Sources: [D1] https://a.example, [D2] https://b.example",
+        "**Sources**:\n[D1] https://a.example  \n[D2] https://b.example",
+        "**Sources:**\n[D1] https://a.example",
+        "### Sources\n[D1] https://a.example  \n[D2] https://b.example",
+    ],
+)
+def test_strips_trailing_source_list(sources):
+    assert strip_source_list(f"{BODY}\n\n{sources}") == BODY
+
+def test_keeps_body_lines_starting_with_citation():
+    assert strip_source_list(BODY) == BODY
+
+def test_keeps_sentences_that_start_with_sources():
+    text = "Sources say the night market is busiest on Fridays [D3]."
+    assert strip_source_list(text) == text
+
+def test_cuts_from_last_heading_only():
+    text = "Sources: the locals I asked [D1].\n\nSources:\n[D1] https://a.example"
+    assert strip_source_list(text) == "Sources: the locals I asked [D1]."
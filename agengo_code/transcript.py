@@ -0,0 +1,19 @@
+import re
+
+# A "Sources" heading on its own line, optionally as Markdown heading or bold, optionally
+# followed by a colon and an inline list, e.g. "### Sources", "**Sources**:", "Sources: [D1] ..."
+SOURCES_HEADING = re.compile(
+    r"^[ \t]*(?:#+[ \t]*)?(?:\*\*)?sources?(?:\*\*)?[ \t]*(?::.*)?$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def strip_source_list(text: str) -> str:
+    """Cut everything from the last "Sources" heading to the end of an answer.
+
+    The local is told to list its sources at the bottom of each answer. The body,
+    including inline [D<n>] citations, is left untouched.
+    """
+    headings = list(SOURCES_HEADING.finditer(text))
+    if not headings:
+        return text
+    return text[:headings[-1].start()].rstrip()
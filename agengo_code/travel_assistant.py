@@ -1,21 +1,33 @@
+import asyncio
 import operator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from collections import Counter
 from pydantic import BaseModel, Field
-from typing import Annotated, List, Dict, Any, Optional
+from typing import Annotated, List, Dict, Any, Optional, Tuple
 from typing_extensions import TypedDict
-import requests
+import aiohttp
+from cachetools import LRUCache, TTLCache
+from diskcache import Index
+import ijson
+import orjson
+import hashlib
 import json
+import logging
 import os, getpass
 from dotenv import load_dotenv
 
 # LangChain and LangGraph imports for LLM, tools, and workflow
-from langchain_community.document_loaders import WikipediaLoader
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 
 from langgraph.types import Send
 from langgraph.graph import END, MessagesState, START, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from llm_cache import LLMCache
+from transcript import strip_source_list
 
 # Helper function to set environment variables interactively if not set
 def _set_env(var: str):
@@ -24,6 +36,7 @@ def _set_env(var: str):
 
 # Load environment variables from .env file and prompt for missing keys
 load_dotenv()
+logger = logging.getLogger(__name__)
 _set_env("OPENAI_API_KEY")
 _set_env("OPENWEATHER_KEY")
 _set_env("TAVILY_API_KEY")
@@ -32,10 +45,15 @@ _set_env("TAVILY_API_KEY")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 OPENWEATHER_KEY = os.environ.get("OPENWEATHER_KEY", "")
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY", "")
+REDIS_URL = os.environ.get("REDIS_URL", "")
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", "checkpoints.sqlite")
+TRAVELERS_CACHE_DIR = os.environ.get("TRAVELERS_CACHE_DIR", ".cache/travelers")
 
 ### LLM initialization
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+# temperature=0 makes responses deterministic, so identical prompts (e.g. replays after
+# human feedback) are served from the cache instead of calling OpenAI again
+llm = ChatOpenAI(model="gpt-4o", temperature=0, cache=LLMCache(redis_url=REDIS_URL or None))
 
 ### Data Schemas
 
@@ -66,22 +84,20 @@ class GenerateTravelersState(TypedDict):
 class dialogueState(MessagesState):
     """State for dialogue between traveler and local."""
     max_num_turns: int  # Number of conversation turns
-    context: Annotated[list, operator.add]
+    context: Annotated[list, operator.add]  # Retrieved (url, content) documents
     traveler: Traveler  # Traveler persona
-    dialogue: str  # Dialogue transcript
-    sections: Annotated[list, operator.add]  # For Send() API
+    dialogues: Annotated[list, operator.add]  # Transcript records handed back to the main graph
     city: str
+    search_query: str  # Query shared by the web and Wikipedia retrievers
+    local_turn_count: int  # Number of answers the local has given
 
-class dialogueOutputState(MessagesState):
+class dialogueOutputState(TypedDict):
     """Output state for dialogue."""
-    context: Annotated[list, operator.add]
-    traveler: Traveler
-    dialogue: str
-    sections: Annotated[list, operator.add]
+    dialogues: Annotated[list, operator.add]  # One {"traveler", "dialogue", "context"} record
 
 class SearchQuery(BaseModel):
     """Schema for search query."""
-    search_query: str = Field(None, description="Search query for retrieval.")
+    search_query: str = Field(description="Search query for retrieval.")
 
 class TravelGraphState(TypedDict):
     """Main workflow state."""
@@ -92,133 +108,235 @@ class TravelGraphState(TypedDict):
     human_feedback_traveler: str
     human_feedback_plan: str
     travelers: List[Traveler]
+    initial_questions: List[AIMessage]  # Opening question per traveler, same order as travelers
+    dialogues: Annotated[list, operator.add]  # Finished dialogue records from the subgraphs
     sections: Annotated[list, operator.add]
     content: str
     final_plan: str
 
+# Structured-output runnables are built once and shared by every node invocation.
+# json_schema + strict uses OpenAI's native structured outputs instead of tool calling.
+traveler_llm = llm.with_structured_output(Perspectives, method="json_schema", strict=True)
+search_query_llm = llm.with_structured_output(SearchQuery, method="json_schema", strict=True)
+
 ### Nodes and workflow logic
 
+# Prompts keep their static instructions first and all interpolated fields in a trailing
+# message, so the unchanged prefix can be served from OpenAI's prompt cache.
+
 # Instructions for traveler persona generation
 traveler_instructions = """You are tasked with creating a set of AI traveler personas. Follow these instructions carefully:
 
-1. First, review the travel city:
-{city}
+1. First, review the travel city given in the trip details.
 
-2. Check the weather for the city:
-{weather}
+2. Check the weather for the city given in the trip details.
 
-3. Check the number of days for the trip:
-{days}
-        
-4. Examine any editorial feedback that has been optionally provided to guide creation of the travelers: 
+3. Check the number of days for the trip given in the trip details.
         
-{human_feedback_traveler}
+4. Examine any editorial feedback that has been optionally provided in the trip details to guide creation of the travelers.
     
-5. Determine the most interesting travel topics. If there is feedback above, you should consider it.
+5. Determine the most interesting travel topics. If there is feedback, you should consider it.
                     
-6. Pick the top {max_travelers} topics.
+6. Pick the top topics, as many as the maximum number of travelers in the trip details.
 
 7. Assign one traveler to each topic."""
 
-def get_latlon(city: str):
+traveler_details = """Trip details:
+
+City: {city}
+
+Days: {days}
+
+Maximum number of travelers: {max_travelers}
+
+Weather: {weather}
+
+Editorial feedback: {human_feedback_traveler}"""
+
+# Pooled HTTP session shared by the geocoding and forecast calls of one open_graph() run.
+# A ContextVar keeps it scoped to the event loop and tasks that opened it.
+_http_session: ContextVar[Optional[aiohttp.ClientSession]] = ContextVar("http_session", default=None)
+
+def new_http_session() -> aiohttp.ClientSession:
+    """Create an aiohttp session that reuses TCP/TLS connections across requests."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=30),
+        timeout=aiohttp.ClientTimeout(total=5),
+    )
+
+# Coordinates practically never change; 3-hourly forecasts rarely change within an hour.
+# Keys are lowercased so replays after human feedback hit the cache.
+_latlon_cache = LRUCache(maxsize=1024)
+_weather_cache = TTLCache(maxsize=256, ttl=3600)
+
+# Prompt templates are compiled once and piped into the LLM
+traveler_prompt = ChatPromptTemplate.from_messages([
+    ("system", traveler_instructions),
+    ("system", traveler_details),
+    ("human", "Generate the set of travelers."),
+])
+traveler_chain = traveler_prompt | traveler_llm
+
+async def get_latlon(session: aiohttp.ClientSession, city: str):
     """Get latitude and longitude for a destination using OpenStreetMap."""
-    resp = requests.get(
+    key = city.lower()
+    if key in _latlon_cache:
+        return _latlon_cache[key]
+    async with session.get(
         "https://nominatim.openstreetmap.org/search",
         params={"q": city, "format": "json", "limit": 1},
         headers={"User-Agent": "Travel-Agent"},
-        timeout=10,
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    ) as resp:
+        resp.raise_for_status()
+        data = orjson.loads(await resp.read())
     if not data:
         raise ValueError(f"Cannot resolve coordinates for '{city}'")
-    return f"{data[0]['lat']},{data[0]['lon']}"
+    latlon = f"{data[0]['lat']},{data[0]['lon']}"
+    _latlon_cache[key] = latlon
+    return latlon
+
+def add_forecast_item(daily: Dict[str, Dict[str, Any]], item: Dict[str, Any]):
+    """Fold one 3-hourly forecast entry into its day's running aggregates."""
+    date = item["dt_txt"][:10]
+    temp = item["main"]["temp"]
+    pop = item.get("pop", 0.0)
+    rec = daily.get(date)
+    if rec is None:
+        daily[date] = {"temp_max": temp, "temp_min": temp, "pop_max": pop, "descs": Counter()}
+        rec = daily[date]
+    else:
+        rec["temp_max"] = max(rec["temp_max"], temp)
+        rec["temp_min"] = min(rec["temp_min"], temp)
+        rec["pop_max"] = max(rec["pop_max"], pop)
+    rec["descs"][item["weather"][0]["description"]] += 1
+
+def summarize_daily(daily: Dict[str, Dict[str, Any]], days: int) -> List[Dict]:
+    """Turn per-day aggregates into the weather summary used by the prompts."""
+    return [
+        {
+            "date": date,
+            "summary": rec["descs"].most_common(1)[0][0],
+            "temp_max": round(rec["temp_max"], 1),
+            "temp_min": round(rec["temp_min"], 1),
+            "pop_max": round(rec["pop_max"], 2),
+        }
+        for date, rec in sorted(daily.items())[:days]
+    ]
+
+async def fetch_forecast(session: aiohttp.ClientSession, city: str, days: int) -> List[Dict]:
+    """Fetch and aggregate the OpenWeather forecast for a city."""
+    lat, lon = map(float, (await get_latlon(session, city)).split(","))
+    async with session.get(
+        "https://api.openweathermap.org/data/2.5/forecast",
+        params={
+            "lat": lat,
+            "lon": lon,
+            "appid": OPENWEATHER_KEY,
+            "units": "metric",
+            "lang": "en",
+        },
+    ) as resp:
+        resp.raise_for_status()
+        # Stream-parse the forecast and aggregate each entry as it arrives, so the full
+        # response is never materialized and aggregation overlaps the network read
+        daily = {}
+        async for item in ijson.items_async(resp.content, "list.item", use_float=True):
+            add_forecast_item(daily, item)
+    return summarize_daily(daily, days)
 
-def get_weather(city: str, days: int = 5) -> List[Dict]:
+async def get_weather(city: str, days: int = 5) -> List[Dict]:
     """Get weather information for a city using OpenWeather API."""
     if not OPENWEATHER_KEY:
         return [{"error": "OpenWeather API key not set"}]
 
-    try:
-        lat, lon = map(float, get_latlon(city).split(","))
-        resp = requests.get(
-            "https://api.openweathermap.org/data/2.5/forecast",
-            params={
-                "lat": lat,
-                "lon": lon,
-                "appid": OPENWEATHER_KEY,
-                "units": "metric",
-                "lang": "en",
-            },
-            timeout=10,
-        )
-        resp.raise_for_status()
-        data = resp.json()["list"]
+    key = (city.lower(), days)
+    if key in _weather_cache:
+        return _weather_cache[key]
 
-        # Aggregate weather data by day
-        daily = {}
-        for item in data:
-            date = item["dt_txt"][:10]
-            if date not in daily:
-                daily[date] = {"temps": [], "descs": [], "pops": []}
-            daily[date]["temps"].append(item["main"]["temp"])
-            daily[date]["descs"].append(item["weather"][0]["description"])
-            daily[date]["pops"].append(item.get("pop", 0.0))
-
-        out = []
-        for date, rec in sorted(daily.items())[:days]:
-            out.append({
-                "date": date,
-                "summary": max(set(rec["descs"]), key=rec["descs"].count),
-                "temp_max": round(max(rec["temps"]), 1),
-                "temp_min": round(min(rec["temps"]), 1),
-                "pop_max": round(max(rec["pops"]), 2),
-            })
-        # Print weather summary for debugging
-        for day in out:
-            if isinstance(day, dict):
-                date = day.get('date', 'N/A')
-                summary = day.get('summary', 'N/A')
-                temp_min = day.get('temp_min', 'N/A')
-                temp_max = day.get('temp_max', 'N/A')
-                pop = day.get('pop_max', 'N/A')
-                print(f"📅 {date}: {temp_min}°C - {temp_max}°C | {summary} | Rain Probability: {pop}")
+    try:
+        session = _http_session.get()
+        if session is None:
+            # Outside open_graph() there is no pooled session, so use one just for this call
+            async with new_http_session() as session:
+                out = await fetch_forecast(session, city, days)
+        else:
+            out = await fetch_forecast(session, city, days)
+        # Log weather summary for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for day in out:
+                logger.debug(
+                    "%s: %s°C - %s°C | %s | Rain Probability: %s",
+                    day["date"], day["temp_min"], day["temp_max"], day["summary"], day["pop_max"],
+                )
+        # Only successful forecasts are cached so transient failures are retried
+        _weather_cache[key] = out
         return out
     except Exception as e:
         return [{"error": f"Failed to get weather information: {str(e)}"}]
 
-def get_weather_info(state: TravelGraphState):
+async def get_weather_info(state: TravelGraphState):
     """Node: Get weather information for the selected city."""
     city = state.get("city", 'tokyo')
     days = state.get("days", 5)
     try:
-        weather = get_weather(city, days)
+        weather = await get_weather(city, days)
     except Exception as e:
         weather = [{"error": f"Failed to get weather: {str(e)}"}]
     return {
         "weather": weather
     }
 
-def create_travelers(state: TravelGraphState):
+# Generated travelers persisted across runs, keyed by everything that goes into the prompt.
+# The model name and template hash invalidate entries when the model or prompt wording changes.
+_travelers_cache: Optional[Index] = None
+_traveler_prompt_hash = hashlib.sha256(
+    (traveler_instructions + traveler_details).encode("utf-8")
+).hexdigest()
+
+def get_travelers_cache() -> Index:
+    """Return the on-disk travelers cache, creating its directory on first use."""
+    global _travelers_cache
+    if _travelers_cache is None:
+        _travelers_cache = Index(TRAVELERS_CACHE_DIR)
+    return _travelers_cache
+
+def travelers_cache_key(city, weather, days, max_travelers, human_feedback_traveler) -> str:
+    """SHA-256 of the model, prompt templates and inputs; edited feedback yields a new key."""
+    payload = json.dumps(
+        [
+            llm.model_name,
+            _traveler_prompt_hash,
+            city,
+            weather,
+            days,
+            max_travelers,
+            human_feedback_traveler,
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def create_travelers(state: TravelGraphState):
     """Node: Create traveler personas based on city, weather, days, and feedback."""
     city = state['city']
     weather = state['weather']
     days = state['days']
     max_travelers = state['max_travelers']
     human_feedback_traveler = state.get('human_feedback_traveler', '')
-    # Use LLM with structured output for traveler generation
-    structured_llm = llm.with_structured_output(Perspectives)
-    system_message = traveler_instructions.format(
-        city=city,
-        weather=weather,
-        days=days,
-        human_feedback_traveler=human_feedback_traveler,
-        max_travelers=max_travelers
-    )
-    travelers = structured_llm.invoke(
-        [SystemMessage(content=system_message)] +
-        [HumanMessage(content="Generate the set of travelers.")]
-    )
+    key = travelers_cache_key(city, weather, days, max_travelers, human_feedback_traveler)
+    travelers_cache = get_travelers_cache()
+    cached = travelers_cache.get(key)
+    if cached is not None:
+        return {"travelers": Perspectives.model_validate_json(cached).travelers}
+    travelers = await traveler_chain.ainvoke({
+        "city": city,
+        "weather": weather,
+        "days": days,
+        "human_feedback_traveler": human_feedback_traveler,
+        "max_travelers": max_travelers,
+    })
+    travelers_cache[key] = travelers.model_dump_json()
     return {"travelers": travelers.travelers}
 
 def feedback_traveler(state: TravelGraphState):
@@ -234,7 +352,7 @@ Your goal is to boil down to interesting and specific information related to you
         
 2. Specific: Insights that avoid generalities and include specific examples from the local.
 
-Here is your interest topic: {topic}
+Your interest topic is given after these instructions.
 
 Begin by introducing yourself using a name that fits your persona, and then ask your question.
 
@@ -244,12 +362,22 @@ When you are satisfied with your goals, complete the talk with: "Thank you so mu
 
 Remember to stay in character throughout your response, reflecting the persona and goals provided to you."""
 
-def generate_question(state: dialogueState):
+question_prompt = ChatPromptTemplate.from_messages([
+    ("system", question_instructions),
+    ("system", "Here is your interest topic: {topic}"),
+    MessagesPlaceholder("messages"),
+])
+question_chain = question_prompt | llm
+
+def opening_message(city: str) -> HumanMessage:
+    """The local's greeting that starts every dialogue."""
+    return HumanMessage(content=f"So you said you plan to have a trip on {city}?")
+
+async def generate_question(state: dialogueState):
     """Node: Generate a question from the traveler to the local."""
     traveler = state["traveler"]
     messages = state["messages"]
-    system_message = question_instructions.format(topic=traveler.persona)
-    question = llm.invoke([SystemMessage(content=system_message)] + messages)
+    question = await question_chain.ainvoke({"topic": traveler.persona, "messages": messages})
     return {"messages": [question]}
 
 # Instructions for search query generation
@@ -263,43 +391,63 @@ Pay particular attention to the final question posed by the traveler.
 
 Convert this final question into a well-structured web search query""")
 
-def search_web(state: dialogueState):
-    """Node: Retrieve documents from web search using Tavily."""
-    tavily_search = TavilySearchResults(max_results=3)
-    structured_llm = llm.with_structured_output(SearchQuery)
-    search_query = structured_llm.invoke([search_instructions] + state['messages'])
-    search_docs = tavily_search.invoke(search_query.search_query)
-    formatted_search_docs = "\n\n---\n\n".join(
-        [
-            f'<Document href="{doc["url"]}"/>\n{doc["content"]}\n</Document>'
-            for doc in search_docs
-        ]
+search_query_prompt = ChatPromptTemplate.from_messages([
+    search_instructions,
+    MessagesPlaceholder("messages"),
+])
+search_query_chain = search_query_prompt | search_query_llm
+
+async def make_search_query(state: dialogueState):
+    """Node: Generate one search query for the traveler's latest question."""
+    search_query = await search_query_chain.ainvoke({"messages": state['messages']})
+    return {"search_query": search_query.search_query}
+
+# Documents are rendered as a "#D<n> url=<url>" header line followed by the raw content,
+# separated by a form feed, instead of wrapping each one in XML-style tags
+DOC_SEPARATOR = "\f"
+
+# Context is stored as raw (url, content) pairs and numbered only when rendered, so
+# documents retrieved on different turns never share a #D<n> id
+def format_docs(docs: List[Tuple[str, str]]) -> str:
+    """Render (url, content) pairs in the compact document format."""
+    return DOC_SEPARATOR.join(
+        f"#D{i} url={url}\n{content}" for i, (url, content) in enumerate(docs, 1)
     )
-    return {"context": [formatted_search_docs]}
-
-def search_wikipedia(state: dialogueState):
-    """Node: Retrieve documents from Wikipedia."""
-    structured_llm = llm.with_structured_output(SearchQuery)
-    search_query = structured_llm.invoke([search_instructions] + state['messages'])
-    search_docs = WikipediaLoader(query=search_query.search_query, load_max_docs=2).load()
-    formatted_search_docs = "\n\n---\n\n".join(
-        [
-            f'<Document source="{doc.metadata["source"]}" page="{doc.metadata.get("page", "")}"/>\n{doc.page_content}\n</Document>'
-            for doc in search_docs
-        ]
+
+async def search_web(search_query: str) -> List[Tuple[str, str]]:
+    """Retrieve documents from web search using Tavily."""
+    # Imported lazily: langchain_community is slow to import and only needed for retrieval
+    from langchain_community.tools.tavily_search import TavilySearchResults
+
+    tavily_search = TavilySearchResults(max_results=3)
+    search_docs = await tavily_search.ainvoke(search_query)
+    return [(doc["url"], doc["content"]) for doc in search_docs]
+
+async def search_wikipedia(search_query: str) -> List[Tuple[str, str]]:
+    """Retrieve documents from Wikipedia."""
+    from langchain_community.document_loaders import WikipediaLoader
+
+    loader = WikipediaLoader(query=search_query, load_max_docs=2)
+    # The Wikipedia client is synchronous, so keep it off the event loop
+    search_docs = await asyncio.get_running_loop().run_in_executor(None, loader.load)
+    return [(doc.metadata["source"], doc.page_content) for doc in search_docs]
+
+async def search_sources(search_query: str) -> List[Tuple[str, str]]:
+    """Retrieve documents from Tavily and Wikipedia concurrently."""
+    web_docs, wiki_docs = await asyncio.gather(
+        search_web(search_query),
+        search_wikipedia(search_query),
     )
-    return {"context": [formatted_search_docs]}
+    return web_docs + wiki_docs
 
 # Instructions for local's answer
-answer_instructions = """You are a local who has been living in the {city} for over 20 years being taking to a traveler.
+answer_instructions = """You are a local who has been living in the city given below for over 20 years being taking to a traveler.
 
-Here is the traveler's interest topic: {topic}. 
+The traveler's interest topic is given below.
         
 You goal is to answer a question posed by the traveler.
 
-To answer question, use this context:
-        
-{context}
+To answer question, use the context provided before the conversation.
 
 When answering questions, follow these guidelines:
         
@@ -307,43 +455,62 @@ When answering questions, follow these guidelines:
         
 2. Do not introduce external information or make assumptions beyond what is explicitly stated in the context.
 
-3. The context contain sources at the topic of each individual document.
+3. Each document in the context starts with a header line like "#D1 url=<link>".
 
-4. Include these sources your answer next to any relevant statements. For example, for source # 1 use [1]. 
+4. Include these sources your answer next to any relevant statements. For example, for document #D1 use [D1]. 
 
-5. List your sources in order at the bottom of your answer. [1] Source 1, [2] Source 2, etc
+5. List your sources in order at the bottom of your answer. [D1] <link>, [D2] <link>, etc
         
  """
 
-def generate_answer(state: dialogueState):
-    """Node: Generate an answer from the local to the traveler."""
+answer_prompt = ChatPromptTemplate.from_messages([
+    ("system", answer_instructions),
+    ("system", "City: {city}\n\nHere is the traveler's interest topic: {topic}"),
+    ("human", "Context:\n\n{context}"),
+    MessagesPlaceholder("messages"),
+])
+answer_chain = answer_prompt | llm
+
+async def retrieve_and_answer(state: dialogueState):
+    """Node: Retrieve documents, then answer as the local (one checkpoint per turn)."""
     traveler = state["traveler"]
     messages = state["messages"]
-    context = state["context"]
     city = state["city"]
-    system_message = answer_instructions.format(city=city, topic=traveler.persona, context=context)
-    answer = llm.invoke([SystemMessage(content=system_message)] + messages)
+    docs = await search_sources(state["search_query"])
+    context = state["context"] + docs
+    answer = await answer_chain.ainvoke({
+        "city": city,
+        "topic": traveler.persona,
+        "context": format_docs(context),
+        "messages": messages,
+    })
     answer.name = "local"
-    return {"messages": [answer]}
+    return {
+        "context": docs,
+        "messages": [answer],
+        "local_turn_count": state.get("local_turn_count", 0) + 1,
+    }
+
+def without_source_list(message):
+    """Drop the trailing source list from one of the local's answers."""
+    # The section writer receives the documents and their links directly
+    if isinstance(message, AIMessage) and message.name == "local":
+        return AIMessage(content=strip_source_list(message.content), name="local")
+    return message
 
 def save_dialogue(state: dialogueState):
-    """Node: Save the dialogue transcript."""
+    """Node: Save the dialogue transcript for the main graph's section writer."""
     messages = state["messages"]
-    dialogue = get_buffer_string(messages)
-    print("💬💬dialogue:" + state["traveler"].name)
-    print("💬" * 50)
-    print(dialogue)
-    print("💬" * 50)
-    return {"dialogue": dialogue}
-
-def route_messages(state: dialogueState, name: str = "local"):
+    traveler = state["traveler"]
+    dialogue = get_buffer_string([without_source_list(m) for m in messages])
+    logger.debug("Dialogue for %s:\n%s", traveler.name, dialogue)
+    return {"dialogues": [{"traveler": traveler, "dialogue": dialogue, "context": state["context"]}]}
+
+def route_messages(state: dialogueState):
     """Node: Route between question and answer, or finish dialogue."""
     messages = state["messages"]
     max_num_turns = state.get('max_num_turns', 2)
-    num_responses = len(
-        [m for m in messages if isinstance(m, AIMessage) and m.name == name]
-    )
-    if num_responses >= max_num_turns:
+    if state.get("local_turn_count", 0) >= max_num_turns:
         return 'save_dialogue'
     last_question = messages[-2]
     if "Thank you so much for your help" in last_question.content:
@@ -356,19 +523,18 @@ section_writer_instructions = """You are an expert report writer.
 Your task is to create a short, easily digestible section of a plan based on a set of source documents.
 
 1. Analyze the content of the source documents: 
-- The name of each source document is at the start of the document, with the <Document tag.
+- Each source document starts with a header line like "#D1 url=<link>"; the link is the document's source.
         
 2. Write the report following this structure:
 
 a. Summary (### header)
 b. Sources (### header)
 
-3. Make your title engaging based upon the topic of the traveler's trip: 
-{topic}
+3. Make your title engaging based upon the topic of the traveler's trip, given below.
 
 4. For the summary section:
-- Set up summary with general context related to the topic of the traveler's trip :{topic}
-- Emphasize what is novel, interesting, or surprising  gathered from the dialogue:{dialogue}
+- Set up summary with general context related to the topic of the traveler's trip
+- Emphasize what is novel, interesting, or surprising  gathered from the dialogue given below
 - Create a numbered list of source documents, as you use them
 - Do not mention the names of travelers or locals
 - Aim for approximately 200 words maximum
@@ -398,63 +564,88 @@ There should be no redundant sources. It should simply be:
 - Include no preamble before the title of the report
 - Check that all guidelines have been followed"""
 
-def write_section(state: dialogueState):
-    """Node: Write a summary section based on the dialogue and context."""
-    dialogue = state["dialogue"]
-    context = state["context"]
-    traveler = state["traveler"]
-    system_message = section_writer_instructions.format(topic=traveler.persona, dialogue=dialogue)
-    section = llm.invoke(
-        [SystemMessage(content=system_message)] +
-        [HumanMessage(content=f"Use this source to write your section: {context}")]
+section_writer_prompt = ChatPromptTemplate.from_messages([
+    ("system", section_writer_instructions),
+    ("system", "Topic of the traveler's trip:\n{topic}\n\nDialogue:\n{dialogue}"),
+    ("human", "Use this source to write your section: {context}"),
+])
+section_writer_chain = section_writer_prompt | llm
+
+async def write_sections_batch(state: TravelGraphState):
+    """Node: Write every traveler's section in one batch once all dialogues are done."""
+    dialogues = state.get("dialogues", [])
+    # Bounded concurrency keeps the fan-in under the provider's rate limits
+    sections = await section_writer_chain.abatch(
+        [
+            {
+                "topic": record["traveler"].persona,
+                "dialogue": record["dialogue"],
+                "context": format_docs(record["context"]),
+            }
+            for record in dialogues
+        ],
+        config={"max_concurrency": 4},
     )
-    print('summary')
-    print("📝" * 50)
-    print(section.content)
-    print('📝' * 50)
-    return {"sections": [section.content]}
+    for record, section in zip(dialogues, sections):
+        logger.debug("Section for %s:\n%s", record["traveler"].name, section.content)
+    return {"sections": [section.content for section in sections]}
 
 # Build the dialogue subgraph
 dialogue_builder = StateGraph(dialogueState, output=dialogueOutputState)
 dialogue_builder.add_node("ask_question", generate_question)
-dialogue_builder.add_node("search_web", search_web)
-dialogue_builder.add_node("search_wikipedia", search_wikipedia)
-dialogue_builder.add_node("answer_question", generate_answer)
+dialogue_builder.add_node("make_search_query", make_search_query)
+dialogue_builder.add_node("retrieve_and_answer", retrieve_and_answer)
 dialogue_builder.add_node("save_dialogue", save_dialogue)
-dialogue_builder.add_node("write_section", write_section)
+
+def start_dialogue(state: dialogueState):
+    """Router: Skip the first question when it was generated upfront in a batch."""
+    if isinstance(state["messages"][-1], AIMessage):
+        return "make_search_query"
+    return "ask_question"
 
 # Dialogue flow
-dialogue_builder.add_edge(START, "ask_question")
-dialogue_builder.add_edge("ask_question", "search_web")
-dialogue_builder.add_edge("ask_question", "search_wikipedia")
-dialogue_builder.add_edge("search_web", "answer_question")
-dialogue_builder.add_edge("search_wikipedia", "answer_question")
-dialogue_builder.add_conditional_edges("answer_question", route_messages, ['ask_question', 'save_dialogue'])
-dialogue_builder.add_edge("save_dialogue", "write_section")
-dialogue_builder.add_edge("write_section", END)
+dialogue_builder.add_conditional_edges(START, start_dialogue, ['ask_question', 'make_search_query'])
+dialogue_builder.add_edge("ask_question", "make_search_query")
+dialogue_builder.add_edge("make_search_query", "retrieve_and_answer")
+dialogue_builder.add_conditional_edges("retrieve_and_answer", route_messages, ['ask_question', 'save_dialogue'])
+dialogue_builder.add_edge("save_dialogue", END)
 
 def conduct_dialogue_router(state: TravelGraphState):
-    """Router: For each traveler, start a dialogue subgraph."""
+    """Router: Regenerate travelers on feedback, otherwise start the dialogues."""
     feedbacks = state.get('human_feedback_traveler')
-    print("human_feedback_traveler =", feedbacks)
+    logger.debug("human_feedback_traveler = %r", feedbacks)
     if feedbacks:
         return "create_travelers"
+    return "generate_initial_questions"
+
+async def generate_initial_questions(state: TravelGraphState):
+    """Node: Generate every traveler's opening question in one batched LLM call."""
+    opening = opening_message(state.get("city", ""))
+    travelers = state.get("travelers", [])
+    questions = await question_chain.abatch(
+        [{"topic": traveler.persona, "messages": [opening]} for traveler in travelers],
+        config={"max_concurrency": 8},
+    )
+    return {"initial_questions": questions}
+
+def initiate_dialogues(state: TravelGraphState):
+    """Router: For each traveler, start a dialogue subgraph from its opening question."""
     city = state.get("city", "")
     max_travelers = state.get("max_travelers", 3)
     travelers = state.get("travelers", [])
+    questions = state.get("initial_questions", [])
     return [Send("conduct_dialogue_sub", {
         "traveler": traveler,
-        "messages": [HumanMessage(content=f"So you said you plan to have a trip on {city}?")],
+        "messages": [opening_message(city), question],
         "max_num_turns": 2,
+        "local_turn_count": 0,
         "context": [],
-        "dialogue": "",
-        "sections": [],
         "city": city,
         "max_travelers": max_travelers
-    }) for traveler in travelers]
+    }) for traveler, question in zip(travelers, questions)]
 
 # Instructions for writing the final travel plan
-plan_writer_instructions = """You are a professional travel planner creating a travel plan on this  city: {city}
+plan_writer_instructions = """You are a professional travel planner creating a travel plan on the city given in the trip details.
     
 You got information from a team of travelers. Each traveler has done two things: 
 
@@ -465,9 +656,9 @@ Your task:
 
 1. You will be given a collection of memos from travelers.
 
-2. Consolidate these into a comprehensive {days} day travel plan that ties together the information from all of the memos. 
+2. Consolidate these into a comprehensive travel plan, covering the number of days in the trip details, that ties together the information from all of the memos. 
 
-5. IMPORTANT: Please consider the weather conditions when planning activities: {weather}
+5. IMPORTANT: Please consider the weather conditions in the trip details when planning activities:
     - For rainy days: Plan indoor activities (museums, shopping malls, restaurants, indoor attractions)
     - For sunny days: Plan outdoor activities (parks, outdoor attractions, walking tours)
     - For hot weather: Include air-conditioned venues and suggest appropriate clothing
@@ -489,7 +680,7 @@ To format your travel plan:
 
 6. Do not mention any traveler or local names in your travel plan.
 
-7. IMPORTANT: if the human feedback is not empty, you should consider it and incorporate it into your travel plan: {human_feedback_plan}
+7. IMPORTANT: if the human feedback in the trip details is not empty, you should consider it and incorporate it into your travel plan.
 
 8. IMPORTANT: In this travel plan:
 - Include all sources used 
@@ -508,13 +699,30 @@ To format your travel plan:
 
 There should be no redundant sources. It should simply be:
 
-[3] https://ai.meta.com/blog/meta-llama-3-1/
+[3] https://ai.meta.com/blog/meta-llama-3-1/"""
+
+plan_details = """Trip details:
+
+City: {city}
+
+Days: {days}
+
+Weather: {weather}
+
+Human feedback: {human_feedback_plan}
 
 Here are the memos from your travelers to build your travel plan from: 
 
 {context}"""
 
-def write_plan(state: TravelGraphState):
+plan_writer_prompt = ChatPromptTemplate.from_messages([
+    ("system", plan_writer_instructions),
+    ("system", plan_details),
+    ("human", "Write a travel plan based upon these memos."),
+])
+plan_writer_chain = plan_writer_prompt | llm
+
+async def write_plan(state: TravelGraphState):
     """Node: Write the final travel plan based on all traveler memos and weather."""
     days = state["days"]
     sections = state["sections"]
@@ -522,14 +730,15 @@ def write_plan(state: TravelGraphState):
     weather = state["weather"]
     human_feedback_plan = state["human_feedback_plan"]
     formatted_str_sections = "\n\n".join([f"{section}" for section in sections])
-    system_message = plan_writer_instructions.format(
-        city=city,
-        days=days,
-        weather=weather,
-        context=formatted_str_sections,
-        human_feedback_plan=human_feedback_plan
-    )
-    plan = llm.invoke([SystemMessage(content=system_message)] + [HumanMessage(content=f"Write a travel plan based upon these memos.")])
+    # ainvoke still emits token events under graph.astream_events, and unlike astream it
+    # goes through the LLM cache
+    plan = await plan_writer_chain.ainvoke({
+        "city": city,
+        "days": days,
+        "weather": weather,
+        "context": formatted_str_sections,
+        "human_feedback_plan": human_feedback_plan,
+    })
     return {"final_plan": plan.content}
 
 def feedback_plan(state: TravelGraphState):
@@ -550,17 +759,31 @@ builder.add_node("get_weather_info", get_weather_info)
 builder.add_node("create_travelers", create_travelers)
 builder.add_node("human_feedback_traveler_node", feedback_traveler)
 builder.add_node("conduct_dialogue_router", conduct_dialogue_router)
+builder.add_node("generate_initial_questions", generate_initial_questions)
 builder.add_node("conduct_dialogue_sub", dialogue_builder.compile())
+builder.add_node("write_sections_batch", write_sections_batch)
 builder.add_node("write_plan", write_plan)
 
 # Main workflow logic
 builder.add_edge(START, "get_weather_info")
 builder.add_edge("get_weather_info", "create_travelers")
 builder.add_edge("create_travelers", "human_feedback_traveler_node")
-builder.add_conditional_edges("human_feedback_traveler_node", conduct_dialogue_router, ["create_travelers", "conduct_dialogue_sub"])
-builder.add_edge("conduct_dialogue_sub", "write_plan")
+builder.add_conditional_edges("human_feedback_traveler_node", conduct_dialogue_router, ["create_travelers", "generate_initial_questions"])
+builder.add_conditional_edges("generate_initial_questions", initiate_dialogues, ["conduct_dialogue_sub"])
+builder.add_edge("conduct_dialogue_sub", "write_sections_batch")
+builder.add_edge("write_sections_batch", "write_plan")
 builder.add_edge("write_plan", END)
 
-# Compile the workflow graph with memory checkpointing
-memory = MemorySaver()
-graph = builder.compile(interrupt_before=['human_feedback_traveler_node'], checkpointer=memory)
+@asynccontextmanager
+async def open_graph():
+    """Yield the workflow graph checkpointed to CHECKPOINT_DB, with a pooled HTTP session.
+
+    The database connection and HTTP session are both closed on exit.
+    """
+    # Both bind to the running event loop, so they are created here rather than at import
+    async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB) as memory, new_http_session() as session:
+        token = _http_session.set(session)
+        try:
+            yield builder.compile(interrupt_before=['human_feedback_traveler_node'], checkpointer=memory)
+        finally:
+            _http_session.reset(token)